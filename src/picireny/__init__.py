@@ -8,7 +8,13 @@
 from . import cli
 from . import info
 from . import transform
-from .cli import __version__, build_with_antlr4, build_with_srcml, reduce
+from .cli import build_with_antlr4, build_with_srcml, reduce
 from .hdd import hddmin
 from .hddr import hddrmin
 from .hdd_tree import HDDRule, HDDToken, HDDTree
+
+
+def __getattr__(name):
+    if name == '__version__':
+        return cli.__version__
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -5,44 +5,62 @@
 # This file may not be copied, modified, or distributed except
 # according to those terms.
 
+import hashlib
+import json
 import logging
-import re
 import shutil
+import struct
 import sys
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from glob import glob
-from os import makedirs, pathsep
-from os.path import basename, join
+from importlib import metadata
+from operator import itemgetter
+from os import close, makedirs, remove, replace, scandir
+from os.path import basename, dirname, join
 from pkgutil import get_data
 from string import Template
 from subprocess import CalledProcessError, PIPE, run, STDOUT
+from tempfile import mkstemp
+from threading import Lock
 
-import xson
-
-from antlr4 import CommonTokenStream, error, InputStream, Token
+from antlr4 import BailErrorStrategy, CommonTokenStream, error, InputStream, PredictionMode, Token
+from antlr4.error.ErrorStrategy import DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
 from antlr4.Token import CommonToken
 
 from .grammar_analyzer import analyze_grammars
-from .parser_builder import build_grammars
+from .islands import compile_island_pattern, split_grammar_rule_name
+from .java_parser_process import java_classpath, JavaParserProcess, javac_version
+from .parser_builder import build_grammars, load_grammars
 from ..hdd_tree import HDDRule, HDDToken, Position
 from ..transform import remove_empty_nodes
 
 
 logger = logging.getLogger(__name__)
 
+# The parser of the grammar analyzer shares its DFA cache between instances,
+# which is not safe to be used from multiple threads at the same time.
+_analyzer_lock = Lock()
+
 
 class HDDQuantifier(HDDRule):
     """
     Special rule type in the HDD tree to support optional quantifiers.
     """
+    __slots__ = ()
+
     def __init__(self, *, start=None, end=None):
-        super().__init__('', start=start, end=end)
+        super().__init__('', start=start, end=end, replace='')
 
 
 class HDDHiddenToken(HDDToken):
     """
     Special token type that represents tokens from hidden channels.
     """
+    __slots__ = ()
 
 
 class HDDErrorToken(HDDToken):
@@ -50,8 +68,10 @@ class HDDErrorToken(HDDToken):
     Special token type that represents unmatched tokens. The minimal replacement
     of such nodes is an empty string.
     """
+    __slots__ = ()
+
     def __init__(self, text, *, start=None, end=None):
-        super().__init__('', text, start=start, end=end)
+        super().__init__('', text, start=start, end=end, replace='')
 
 
 # Override ConsoleErrorListener to suppress parse issues in non-verbose mode.
@@ -63,11 +83,52 @@ class ConsoleListener(error.ErrorListener.ConsoleErrorListener):
 error.ErrorListener.ConsoleErrorListener.INSTANCE = ConsoleListener()
 
 
+class CodePointStream(InputStream):
+    """
+    Input stream that keeps the code points of its content in a packed buffer
+    of the native UTF-32 encoding instead of a list of int objects, which takes
+    less than half the memory and is built without a Python-level loop.
+    """
+    __slots__ = ()
+
+    _encoding = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+    def _loadString(self):
+        self._index = 0
+        # Lone surrogates (e.g., from undecodable input bytes) are kept as is,
+        # just like ord() would return them.
+        self.data = memoryview(self.strdata.encode(self._encoding, 'surrogatepass')).cast('I')
+        self._size = len(self.data)
+
+
+# Actions to inject to the start ('s') and end ('e') of quantified parts of
+# parser rules, in the supported target languages.
+_optional_actions = {
+    'python': {
+        's': b'({self.enter_optional()} ',
+        'e': b' {self.exit_optional()})'
+    },
+    'java': {
+        's': b'({ try { getClass().getMethod("enter_optional").invoke(this); } catch (Exception e) { assert false; }} ',
+        'e': b' { try { getClass().getMethod("exit_optional").invoke(this); } catch (Exception e) { assert false; }})'
+    }
+}
+
+
+# Events triggered by the extended parsers in their listeners.
+_listener_events = ('enter_optional', 'exit_optional', 'recursion_enter', 'recursion_push', 'recursion_unroll')
+
+# Node types and number formats in the dump of the Java parser.
+_JAVA_RULE, _JAVA_QUANTIFIER, _JAVA_TOKEN, _JAVA_HIDDEN_TOKEN, _JAVA_ERROR_TOKEN = range(5)
+_JAVA_INT = struct.Struct('>i')
+_JAVA_POSITIONS = struct.Struct('>4i')
+
+
 def create_hdd_tree(src, *,
                     input_format, start,
-                    antlr, lang='python',
+                    antlr, lang='python', embedded_antlr=False,
                     hidden_tokens=False,
-                    work_dir):
+                    work_dir, cache_dir=None):
     """
     Build a tree that the HDD algorithm can work with.
 
@@ -76,12 +137,22 @@ def create_hdd_tree(src, *,
     :param start: Name of the start rule in [grammarname:]rulename format.
     :param antlr: Path to the ANTLR4 tool (Java jar binary).
     :param lang: The target language of the parser.
+    :param embedded_antlr: Run the ANTLR4 tool in a JVM embedded into the
+        current process (needs JPype).
     :param hidden_tokens: Build hidden tokens of the input format into the HDD
         tree.
     :param work_dir: Working directory.
+    :param cache_dir: Directory to keep prepared grammars in, so that they can
+        be reused by later runs (default: a subdirectory of work_dir).
     :return: The root of the created HDD tree.
     """
 
+    optional_actions = _optional_actions[lang]
+    if cache_dir is None:
+        cache_dir = join(work_dir, '.picireny_cache')
+    java_processes = []
+    preparation_lock = Lock()
+
     def inject_optional_actions(grammar, positions, target_file):
         """
         Update the original parser grammar by injecting actions to the start and
@@ -92,34 +163,33 @@ def create_hdd_tree(src, *,
         :param target_file: Path to the updated grammar.
         """
         with open(grammar, 'rb') as f:
-            lines = f.read().splitlines(True)
-
-        languages = {
-            'python': {
-                'prefix': b'({self.enter_optional()} ',
-                'postfix': b' {self.exit_optional()})'
-            },
-            'java': {
-                'prefix': b'({ try { getClass().getMethod("enter_optional").invoke(this); } catch (Exception e) { assert false; }} ',
-                'postfix': b' { try { getClass().getMethod("exit_optional").invoke(this); } catch (Exception e) { assert false; }})'
-            }
-        }
-
-        for ln in positions:
-            offset = 0
-            for position in sorted(positions[ln], key=lambda x: x[1]):
-                if position[0] == 's':
-                    lines[ln - 1] = lines[ln - 1][0:position[1] + offset] + languages[lang]['prefix'] + lines[ln - 1][position[1] + offset:]
-                    offset += len(languages[lang]['prefix'])
-                elif position[0] == 'e':
-                    lines[ln - 1] = lines[ln - 1][0:position[1] + offset] + languages[lang]['postfix'] + lines[ln - 1][position[1] + offset:]
-                    offset += len(languages[lang]['postfix'])
-
+            content = f.read()
+
+        # Offsets of line starts in the content (lines are numbered from 1, as
+        # in ANTLR, and are terminated by line feeds).
+        line_starts = [0, 0]
+        line_end = content.find(b'\n')
+        while line_end != -1:
+            line_starts.append(line_end + 1)
+            line_end = content.find(b'\n', line_end + 1)
+        line_starts.append(len(content))
+
+        # Translate line-column positions to offsets in the content. Processing
+        # lines and columns in order yields the offsets in increasing order.
+        insertions = []
+        for ln in sorted(positions):
+            line_start, line_end = line_starts[ln], line_starts[ln + 1]
+            for kind, column in sorted(positions[ln], key=lambda x: x[1]):
+                insertions.append((min(line_start + column, line_end), optional_actions[kind]))
+
+        content = memoryview(content)
         with open(target_file, 'wb') as f:
-            f.write(b''.join(lines))
-
-    def java_classpath(current_workdir):
-        return pathsep.join([antlr, current_workdir])
+            last_offset = 0
+            for offset, action in insertions:
+                f.write(content[last_offset:offset])
+                f.write(action)
+                last_offset = offset
+            f.write(content[last_offset:])
 
     def compile_java_sources(lexer, parser, listener, current_workdir):
         executor = Template(get_data(__package__, 'resources/ExtendedTargetParser.java').decode('utf-8'))
@@ -128,12 +198,108 @@ def create_hdd_tree(src, *,
                                          'parser_class': parser,
                                          'listener_class': listener}))
         try:
-            run(('javac', '-classpath', java_classpath(current_workdir)) + tuple(basename(j) for j in glob(join(current_workdir, '*.java'))),
+            run(('javac', '-classpath', java_classpath(antlr, current_workdir)) + tuple(basename(j) for j in glob(join(current_workdir, '*.java'))),
                 stdout=PIPE, stderr=STDOUT, cwd=current_workdir, check=True)
         except CalledProcessError as e:
-            logger.error('Java compile failed!\n%s\n', e.output)
+            logger.error('Java compile failed!\n%s\n', e.output.decode(errors='replace'))
             raise
 
+    def grammar_digest(grammar_files, resources, replacements):
+        """
+        Compute a digest that identifies the result of preparing a grammar.
+
+        :param grammar_files: List of the grammar files.
+        :param resources: List of the other files needed by the grammar.
+        :param replacements: Dictionary of the predefined replacements.
+        :return: Hexadecimal digest of the inputs of the preparation.
+        """
+        digest = hashlib.sha256()
+        # The cache may outlive the installed version of picireny, which
+        # determines how grammars are analyzed and extended.
+        digest.update(f'{metadata.version("picireny")}\0{antlr}\0{lang}\0{json.dumps(replacements, sort_keys=True)}\0'.encode('utf-8'))
+        for fn in grammar_files + resources:
+            with open(fn, 'rb') as f:
+                content = f.read()
+            digest.update(f'{basename(fn)}\0{len(content)}\0'.encode('utf-8'))
+            digest.update(content)
+        if lang == 'java':
+            # The compiled parser depends on the template of its extension and
+            # on the version of the compiler, too.
+            digest.update(get_data(__package__, 'resources/ExtendedTargetParser.java'))
+            digest.update(javac_version())
+        return digest.hexdigest()
+
+    def load_prepared_grammar(cache_path, current_workdir):
+        """
+        Restore the files of a grammar prepared earlier into the working
+        directory.
+
+        :param cache_path: Path prefix of the cache entry of the grammar.
+        :param current_workdir: Working directory of the grammar.
+        :return: Pair of the replacement dictionary and the names of the lexer,
+            parser and listener classes of the target, or None if the grammar
+            has not been prepared yet.
+        """
+        try:
+            with open(f'{cache_path}.json', 'r') as f:
+                prepared = json.load(f)
+
+            with scandir(cache_path) as entries:
+                for entry in entries:
+                    # Skip the temporary files of unfinished writes.
+                    if not entry.name.startswith('.'):
+                        shutil.copy(entry.path, current_workdir)
+        except (OSError, ValueError):
+            # The entry is incomplete or (partially) removed, the grammar is
+            # prepared again (overwriting the files already restored).
+            logger.debug('Cache entry %s cannot be restored.', cache_path)
+            return None
+        return prepared['replacements'], prepared['classes']
+
+    def write_atomically(path, write):
+        """
+        Create a file under a temporary name and move it in place when it is
+        complete, so that other runs sharing the cache never see it half
+        written, even if the current run is killed.
+
+        :param path: Path of the file to create.
+        :param write: Function that writes the content of the file to the path
+            it is called with.
+        """
+        fd, tmp_path = mkstemp(prefix='.', suffix='.tmp', dir=dirname(path))
+        close(fd)
+        try:
+            write(tmp_path)
+            replace(tmp_path, path)
+        except BaseException:
+            remove(tmp_path)
+            raise
+
+    def save_prepared_grammar(cache_path, current_workdir, replacements, classes):
+        """
+        Save the files of a freshly prepared grammar from the working directory
+        to the cache.
+
+        :param cache_path: Path prefix of the cache entry of the grammar.
+        :param current_workdir: Working directory of the grammar.
+        :param replacements: The replacement dictionary of the grammar.
+        :param classes: List of the references/names of the lexer, parser and
+            listener classes of the target.
+        """
+        def write_description(path):
+            with open(path, 'w') as f:
+                json.dump({'replacements': replacements,
+                           'classes': [c if isinstance(c, str) else c.__name__ for c in classes]}, f)
+
+        makedirs(cache_path, exist_ok=True)
+        with scandir(current_workdir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    write_atomically(join(cache_path, entry.name), partial(shutil.copy, entry.path))
+        # The description of the entry is written last, as it marks the entry
+        # complete.
+        write_atomically(f'{cache_path}.json', write_description)
+
     def prepare_parsing(grammar_name):
         """
         Performs initiative steps needed to parse the input test case (like
@@ -145,28 +311,52 @@ def create_hdd_tree(src, *,
         resources = [fn for fn in grammar['files'] if not fn.endswith('.g4')]
         grammar['files'] = [fn for fn in grammar['files'] if fn.endswith('.g4')]
 
-        replacements, action_positions = analyze_grammars(grammar['files'], grammar['replacements'])
-        logger.debug('Replacements are calculated...')
-
         current_workdir = join(work_dir, grammar_name) if grammar_name else work_dir
         makedirs(current_workdir, exist_ok=True)
         if current_workdir not in sys.path:
             sys.path.append(current_workdir)
 
-        # Inject actions into the target grammars to help localizing part of the test case that are optional.
-        for i, g in enumerate(grammar['files']):
-            grammar['files'][i] = join(current_workdir, basename(g))
-            inject_optional_actions(g, action_positions[g], grammar['files'][i])
+        cache_path = join(cache_dir, grammar_digest(grammar['files'], resources, grammar['replacements']))
+        prepared = load_prepared_grammar(cache_path, current_workdir)
+
+        if prepared:
+            replacements, class_names = prepared
+            grammar['files'] = [join(current_workdir, basename(g)) for g in grammar['files']]
+            target_lexer_class, target_parser_class, target_listener_class = load_grammars(tuple(grammar['files']), current_workdir, class_names, lang, tuple(resources))
+            logger.debug('Target grammars are restored from cache...')
+        else:
+            with _analyzer_lock:
+                replacements, action_positions = analyze_grammars(grammar['files'], grammar['replacements'])
+            logger.debug('Replacements are calculated...')
+
+            # Inject actions into the target grammars to help localizing part of the test case that are optional.
+            for i, g in enumerate(grammar['files']):
+                grammar['files'][i] = join(current_workdir, basename(g))
+                inject_optional_actions(g, action_positions[g], grammar['files'][i])
 
-        for r in resources:
-            shutil.copy(r, current_workdir)
+            for r in resources:
+                shutil.copy(r, current_workdir)
 
-        target_lexer_class, target_parser_class, target_listener_class = build_grammars(tuple(grammar['files']), current_workdir, antlr, lang)
-        logger.debug('Target grammars are processed...')
+            target_lexer_class, target_parser_class, target_listener_class = build_grammars(tuple(grammar['files']), current_workdir, antlr, lang, embedded_antlr, tuple(resources))
+            logger.debug('Target grammars are processed...')
+
+            if lang == 'java':
+                compile_java_sources(target_lexer_class, target_parser_class, target_listener_class, current_workdir)
+
+            save_prepared_grammar(cache_path, current_workdir, replacements, (target_lexer_class, target_parser_class, target_listener_class))
+
+        # Compile the island patterns of the grammar once. (They may have been
+        # compiled already if the input format is reused.)
+        islands = grammar['islands']
+        for name, pattern in islands.items():
+            if isinstance(pattern, str):
+                islands[name] = compile_island_pattern(pattern)
 
         if lang == 'java':
-            compile_java_sources(target_lexer_class, target_parser_class, target_listener_class, current_workdir)
-            input_format[grammar_name].update(lexer=target_lexer_class, parser=target_parser_class, listener=target_listener_class, replacements=replacements)
+            process = JavaParserProcess(('java', '-classpath', java_classpath(antlr, current_workdir), f'Extended{target_parser_class}', str(hidden_tokens).lower()),
+                                        cwd=current_workdir)
+            java_processes.append(process)
+            grammar.update(lexer=target_lexer_class, parser=target_parser_class, listener=target_listener_class, replacements=replacements, process=process)
             return
 
         class ExtendedTargetLexer(target_lexer_class):
@@ -192,6 +382,12 @@ def create_hdd_tree(src, *,
             identify parts of the input that are not needed to keep it
             syntactically correct.
             """
+            # The handlers of the events in the parse listeners, collected
+            # whenever the listeners change, to avoid looking them up for every
+            # triggered event. (The names start with an underscore so that they
+            # cannot clash with the names of parser rules.)
+            _event_handlers = dict.fromkeys(_listener_events, ())
+
             def enter_optional(self):
                 self.trigger_listener('enter_optional')
 
@@ -210,16 +406,37 @@ def create_hdd_tree(src, *,
                 super().unrollRecursionContexts(parentCtx)
                 self.trigger_listener('recursion_unroll')
 
+            def addParseListener(self, listener):
+                super().addParseListener(listener)
+                self._collect_event_handlers()
+
+            def removeParseListener(self, listener):
+                super().removeParseListener(listener)
+                self._collect_event_handlers()
+
+            def removeParseListeners(self):
+                super().removeParseListeners()
+                self._collect_event_handlers()
+
+            def _collect_event_handlers(self):
+                listeners = self.getParseListeners()
+                self._event_handlers = {event: tuple(getattr(listener, event) for listener in listeners if hasattr(listener, event))
+                                        for event in _listener_events}
+
             def trigger_listener(self, event):
-                for listener in self.getParseListeners():
-                    if hasattr(listener, event):
-                        getattr(listener, event)()
+                for handler in self._event_handlers[event]:
+                    handler()
 
             def syntax_error_warning(self):
                 if self.getNumberOfSyntaxErrors() > 0:
                     logger.warning('%s finished with %d syntax errors. This may decrease reduce quality.',
                                    target_parser_class.__name__, self.getNumberOfSyntaxErrors())
 
+        # The names used by the listener are the same for every parse.
+        rule_names = target_parser_class.ruleNames
+        symbolic_names = target_parser_class.symbolicNames
+        island_names = frozenset(grammar['islands'])
+
         class ExtendedTargetListener(target_listener_class):
             """
             ExtendedTargetListener is a subclass of the original listener
@@ -229,6 +446,9 @@ def create_hdd_tree(src, *,
             """
             def __init__(self, parser):
                 self.parser = parser
+                # The token stream is expected to be filled before parsing
+                # starts, so hidden tokens can be collected from its buffer.
+                self.tokens = parser.getTokenStream().tokens
                 self.current_node = None
                 self.root = None
                 self.seen_terminal = False
@@ -236,7 +456,7 @@ def create_hdd_tree(src, *,
 
             def recursion_enter(self):
                 assert isinstance(self.current_node, HDDRule)
-                node = HDDRule(self.current_node.name)
+                node = HDDRule(self.current_node.name, replace=replacements[self.current_node.name])
                 self.current_node.add_child(node)
                 self.current_node.recursive_rule = True
                 self.current_node = node
@@ -254,15 +474,17 @@ def create_hdd_tree(src, *,
                 children_to_lift = self.current_node.children[0].children
                 parent = self.current_node.parent
                 if children_to_lift:
-                    self.current_node.children = []
-                    self.current_node.add_children(children_to_lift)
+                    # Take over the list of children instead of rebuilding it.
+                    self.current_node.children = children_to_lift
+                    for child in children_to_lift:
+                        child.parent = self.current_node
                 else:
                     parent.remove_child(self.current_node)
                 self.current_node = parent
 
             def enterEveryRule(self, ctx):
-                name = self.parser.ruleNames[ctx.getRuleIndex()]
-                node = HDDRule(name)
+                name = rule_names[ctx.getRuleIndex()]
+                node = HDDRule(name, replace=replacements[name])
                 if not self.root:
                     self.root = node
                 else:
@@ -275,8 +497,8 @@ def create_hdd_tree(src, *,
                 while isinstance(self.current_node, HDDQuantifier):
                     self.exit_optional()
 
-                assert self.current_node.name == self.parser.ruleNames[ctx.getRuleIndex()], \
-                    f'{self.current_node.name} ({self.current_node!r}) != {self.parser.ruleNames[ctx.getRuleIndex()]}'
+                assert self.current_node.name == rule_names[ctx.getRuleIndex()], \
+                    f'{self.current_node.name} ({self.current_node!r}) != {rule_names[ctx.getRuleIndex()]}'
 
                 if self.current_node.parent:
                     self.current_node = self.current_node.parent
@@ -285,36 +507,48 @@ def create_hdd_tree(src, *,
                 start = Position(token.line, token.column)
                 return start, start.after(token.text)
 
+            def hiddenToken(self, token):
+                name = symbolic_names[token.type]
+                start, end = self.tokenBoundaries(token)
+                return HDDHiddenToken(name, token.text, start=start, end=end,
+                                      replace=replacements.get(name, token.text))
+
             def addToken(self, node, child):
-                if not self.seen_terminal:
-                    hidden_tokens = self.parser.getTokenStream().getHiddenTokensToLeft(node.symbol.tokenIndex, -1) or []
-                    for token in hidden_tokens:
-                        start, end = self.tokenBoundaries(token)
-                        self.current_node.add_child(HDDHiddenToken(self.parser.symbolicNames[token.type], token.text,
-                                                                   start=start, end=end))
+                tokens = self.tokens
+                index = node.symbol.tokenIndex
+
+                if hidden_tokens and not self.seen_terminal:
+                    # Hidden tokens to the left, up to the previous token on the default channel.
+                    left = index
+                    while left > 0 and tokens[left - 1].channel != Token.DEFAULT_CHANNEL:
+                        left -= 1
+                    for token in tokens[left:index]:
+                        self.current_node.add_child(self.hiddenToken(token))
                 self.seen_terminal = True
 
                 self.current_node.add_child(child)
 
-                hidden_tokens = self.parser.getTokenStream().getHiddenTokensToRight(node.symbol.tokenIndex, -1) or []
-                for token in hidden_tokens:
-                    start, end = self.tokenBoundaries(token)
-                    self.current_node.add_child(HDDHiddenToken(self.parser.symbolicNames[token.type], token.text,
-                                                               start=start, end=end))
+                if hidden_tokens:
+                    # Hidden tokens to the right, up to the next token on the default channel.
+                    right = index + 1
+                    while right < len(tokens) and tokens[right].channel != Token.DEFAULT_CHANNEL:
+                        right += 1
+                    for token in tokens[index + 1:right]:
+                        self.current_node.add_child(self.hiddenToken(token))
 
             def visitTerminal(self, node):
                 token = node.symbol
-                name, text = (self.parser.symbolicNames[token.type], token.text) if token.type != Token.EOF else ('EOF', '')
+                name, text = (symbolic_names[token.type], token.text) if token.type != Token.EOF else ('EOF', '')
                 start, end = self.tokenBoundaries(token)
 
-                child = HDDToken(name, text, start=start, end=end)
+                child = HDDToken(name, text, start=start, end=end, replace=replacements.get(name, text))
                 self.addToken(node, child)
-                if name in grammar['islands']:
+                if name in island_names:
                     self.island_nodes.append(child)
 
             def visitErrorNode(self, node):
-                if hasattr(node, 'symbol'):
-                    token = node.symbol
+                token = getattr(node, 'symbol', None)
+                if token:
                     start, end = self.tokenBoundaries(token)
                     self.addToken(node, HDDErrorToken(token.text, start=start, end=end))
 
@@ -329,7 +563,7 @@ def create_hdd_tree(src, *,
 
                 self.current_node = self.current_node.parent
 
-        input_format[grammar_name].update(lexer=ExtendedTargetLexer, parser=ExtendedTargetParser, listener=ExtendedTargetListener, replacements=replacements)
+        grammar.update(lexer=ExtendedTargetLexer, parser=ExtendedTargetParser, listener=ExtendedTargetListener, replacements=replacements)
 
     class ExtendedErrorListener(error.ErrorListener.ErrorListener):
 
@@ -355,138 +589,301 @@ def create_hdd_tree(src, *,
         """
 
         grammar = input_format[grammar_name]
+        replacements = grammar['replacements']
+        islands = grammar['islands']
         island_nodes = []
 
-        def set_replacement(node):
-            if isinstance(node, (HDDQuantifier, HDDErrorToken)):
-                node.replace = ''
-            elif isinstance(node, HDDRule):
-                node.replace = grammar['replacements'][node.name]
-            else:
-                node.replace = grammar['replacements'].get(node.name, node.text)
-
-            if isinstance(node, HDDRule):
-                for child in node.children:
-                    set_replacement(child)
-
         logger.debug('Parse input with %s rule', start_rule)
         if lang != 'python':
-
-            def hdd_tree_from_dict(node_dict):
-                # Convert interval dictionaries to Position objects.
-                if 'start' in node_dict:
-                    node_dict['start'] = Position(**node_dict['start'])
-                if 'end' in node_dict:
-                    node_dict['end'] = Position(**node_dict['end'])
-
-                name = node_dict.get('name', None)
-                children = node_dict.pop('children', None)
-                cls = globals()[node_dict.pop('type')]
-                node = cls(**node_dict)
-
-                if children:
-                    for child in children:
-                        node.add_child(hdd_tree_from_dict(child))
-                elif name:
-                    if name in grammar['islands']:
-                        island_nodes.append(node)
-                return node
+            def hdd_tree_from_dump(dump):
+                # Decode the pre-order dump of the Java parser (see the format
+                # in ExtendedTargetParser.java) with an explicit stack of the
+                # rules and the number of their children still to be read.
+                # Names are interned, as they repeat across the nodes.
+                offset = 0
+
+                def read_string():
+                    nonlocal offset
+                    size, = _JAVA_INT.unpack_from(dump, offset)
+                    offset += _JAVA_INT.size + size
+                    return str(dump[offset - size:offset], 'utf-8')
+
+                root = None
+                stack = []
+                while True:
+                    node_type = dump[offset]
+                    offset += 1
+                    children = 0
+                    if node_type in (_JAVA_RULE, _JAVA_QUANTIFIER):
+                        if node_type == _JAVA_RULE:
+                            name = sys.intern(read_string())
+                            node = HDDRule(name, replace=replacements[name])
+                        else:
+                            node = HDDQuantifier()
+                        children, = _JAVA_INT.unpack_from(dump, offset)
+                        offset += _JAVA_INT.size
+                    else:
+                        name = sys.intern(read_string()) if node_type != _JAVA_ERROR_TOKEN else None
+                        text = read_string()
+                        start_line, start_column, end_line, end_column = _JAVA_POSITIONS.unpack_from(dump, offset)
+                        offset += _JAVA_POSITIONS.size
+                        start, end = Position(start_line, start_column), Position(end_line, end_column)
+                        if node_type == _JAVA_ERROR_TOKEN:
+                            node = HDDErrorToken(text, start=start, end=end)
+                        else:
+                            cls = HDDToken if node_type == _JAVA_TOKEN else HDDHiddenToken
+                            node = cls(name, text, start=start, end=end, replace=replacements.get(name, text))
+                            if name in islands:
+                                island_nodes.append(node)
+
+                    if stack:
+                        stack[-1][0].add_child(node)
+                        stack[-1][1] -= 1
+                    else:
+                        root = node
+                    if children:
+                        stack.append([node, children])
+                    while stack and not stack[-1][1]:
+                        stack.pop()
+                    if not stack:
+                        return root
 
             try:
-                current_workdir = join(work_dir, grammar_name) if grammar_name else work_dir
-                proc = run(('java', '-classpath', java_classpath(current_workdir), f'Extended{grammar["parser"]}', start_rule),
-                           input=src, stdout=PIPE, stderr=PIPE, universal_newlines=True, cwd=current_workdir, check=True)
-                if proc.stderr:
-                    logger.debug(proc.stderr)
-                result = xson.loads(proc.stdout)
-                tree_root = hdd_tree_from_dict(result)
+                tree_root = hdd_tree_from_dump(memoryview(grammar['process'].parse(src, start_rule)))
             except CalledProcessError as e:
                 logger.error('Java parser failed!\n%s\n%s', e.stdout, e.stderr)
                 raise
         else:
-            lexer = grammar['lexer'](InputStream(src))
+            lexer = grammar['lexer'](CodePointStream(src))
             lexer.addErrorListener(ExtendedErrorListener())
-            target_parser = grammar['parser'](CommonTokenStream(lexer))
-            parser_listener = grammar['listener'](target_parser)
-            target_parser.addParseListener(parser_listener)
-
-            getattr(target_parser, start_rule)()
+            token_stream = CommonTokenStream(lexer)
+            token_stream.fill()
+            target_parser = grammar['parser'](token_stream)
+            # The HDD tree is built by the parse listener, the parse tree of
+            # ANTLR is not needed. Without it, the contexts of the rules that
+            # have been parsed are not kept alive by their parents.
+            target_parser.buildParseTrees = False
+
+            def parse(prediction_mode, error_strategy):
+                target_parser.reset()
+                target_parser._interp.predictionMode = prediction_mode
+                target_parser._errHandler = error_strategy
+                listener = grammar['listener'](target_parser)
+                target_parser.addParseListener(listener)
+                try:
+                    getattr(target_parser, start_rule)()
+                finally:
+                    target_parser.removeParseListener(listener)
+                return listener
+
+            # Two-stage parsing: try the faster SLL prediction first, which
+            # either yields the same result as full LL prediction or fails (with
+            # a syntax error that is either real or caused by the weakness of
+            # SLL). Only reparse with LL (and with error recovery) if SLL fails.
+            # Syntax errors are not reported in the first stage.
+            target_parser.removeErrorListeners()
+            try:
+                parser_listener = parse(PredictionMode.SLL, BailErrorStrategy())
+            except ParseCancellationException:
+                logger.debug('SLL parse failed, reparsing with LL.')
+                target_parser.addErrorListener(error.ErrorListener.ConsoleErrorListener.INSTANCE)
+                parser_listener = parse(PredictionMode.LL, DefaultErrorStrategy())
             target_parser.syntax_error_warning()
             island_nodes = parser_listener.island_nodes
             assert parser_listener.root == parser_listener.current_node
             tree_root = parser_listener.root
 
-        # Traverse the HDD tree and set minimal replacements for nodes.
-        set_replacement(tree_root)
-        process_island_nodes(island_nodes, grammar['islands'])
+        process_island_nodes(island_nodes, islands)
         logger.debug('Parse done.')
         return tree_root
 
     def process_island_nodes(island_nodes, island_format):
-        for node in island_nodes:
-            if not isinstance(island_format[node.name], tuple):
-                rewritten, mapping = rename_regex_groups(island_format[node.name])
-                for new_name, old_name in mapping.items():
-                    grammar_name, rule_name = split_grammar_rule_name(old_name)
-                    mapping[new_name] = (grammar_name, rule_name)
-                    if 'lexer' not in input_format[grammar_name]:
-                        prepare_parsing(grammar_name)
-                island_format[node.name] = (re.compile(rewritten, re.S), mapping)
+        # The grammars of the islands are prepared on first use. They are
+        # independent of each other and most of the time of their preparation
+        # is spent in ANTLR and javac subprocesses, so prepare them in parallel.
+        # (Islands may be processed from multiple threads, see below, which
+        # must not prepare the same grammar twice.)
+        with preparation_lock:
+            unprepared_grammars = {grammar_name
+                                   for island_name in {node.name for node in island_nodes}
+                                   for _, grammar_name, _ in island_format[island_name][1]
+                                   if 'lexer' not in input_format[grammar_name]}
+            # Every preparation may run a JVM, so don't run too many at once.
+            if len(unprepared_grammars) > 1:
+                with ThreadPoolExecutor(max_workers=min(8, len(unprepared_grammars))) as executor:
+                    list(executor.map(prepare_parsing, unprepared_grammars))
+            elif unprepared_grammars:
+                prepare_parsing(*unprepared_grammars)
+
+        intervals = [find_island_intervals(node.text, *island_format[node.name]) for node in island_nodes]
+
+        # The texts of the islands are sliced only when they are parsed, so
+        # that they don't have to be kept in memory all at once.
+        def islands():
+            return ((node.text[start:end], grammar_name, rule_name)
+                    for node, node_intervals in zip(island_nodes, intervals)
+                    for start, end, grammar_name, rule_name in node_intervals)
+
+        # Inputs often repeat the same island (e.g., the same inline script or
+        # style attribute), so identical islands are parsed only once and each
+        # of their occurrences gets a copy of the parsed tree.
+        occurrences = Counter((hash(text), grammar_name, rule_name) for text, grammar_name, rule_name in islands())
+        parsed_islands = {}
+
+        def parse_island(island):
+            text, grammar_name, rule_name = island
+            if occurrences[hash(text), grammar_name, rule_name] < 2:
+                return build_hdd_tree(*island)
+            if island not in parsed_islands:
+                parsed_islands[island] = build_hdd_tree(*island)
+            return clone_tree(parsed_islands[island])
+
+        # Java parsers run in separate processes, so islands of different
+        # grammars can be parsed in parallel. Python parsers would only compete
+        # for the GIL, so they parse the islands one after the other, when
+        # their subtrees are needed.
+        if lang == 'java' and sum(len(node_intervals) for node_intervals in intervals) > 1:
+            with ThreadPoolExecutor() as executor:
+                # Parse the repeated islands up front, so that concurrent
+                # occurrences don't parse them again.
+                repeated = {island for island in islands()
+                            if occurrences[hash(island[0]), island[1], island[2]] > 1}
+                parsed_islands.update(zip(repeated, executor.map(lambda island: build_hdd_tree(*island), repeated)))
+                island_roots = iter(list(executor.map(parse_island, islands())))
+        else:
+            island_roots = (parse_island(island) for island in islands())
 
+        for node, node_intervals in zip(island_nodes, intervals):
             new_node = HDDRule(node.name, replace=node.replace)
-            new_node.add_children(build_island_subtree(node, *island_format[node.name]))
+            new_node.add_children(build_island_subtree(node, node_intervals, island_roots))
             node.replace_with(new_node)
 
-    def build_island_subtree(node, pattern, mapping):
+    def find_island_intervals(content, pattern, group_table):
+        """
+        Find the parts of a terminal that belong to island languages.
+
+        :param content: Text of the terminal.
+        :param pattern: Compiled pattern of the island language.
+        :param group_table: List of (group number, grammar name, rule name)
+            triplets describing the groups of the pattern.
+        :return: List of (start, end, grammar name, rule name) tuples describing
+            a non-overlapping splitting of the content, sorted by position.
+        """
+        intervals = []
+        # Matches are found in order, so the intervals are usually sorted
+        # already, unless the groups of a match are not in order.
+        ordered = True
+        last_start, last_end = 0, 0
+        for m in pattern.finditer(content):
+            for num, grammar_name, rule_name in group_table:
+                start, end = m.span(num)
+                if start != end:
+                    if start < last_start or (start == last_start and end < last_end):
+                        ordered = False
+                    last_start, last_end = start, end
+                    intervals.append((start, end, grammar_name, rule_name))
+        if not ordered:
+            intervals.sort(key=itemgetter(0, 1))
+        return intervals
+
+    def clone_tree(root):
+        """
+        Copy an HDD tree built from an island. The nodes of the copy get new
+        ids and positions, so it can be shifted and reduced independently of
+        the original.
+
+        :param root: The root of the tree to copy.
+        :return: The root of the copy.
+        """
+        def clone_position(position):
+            return Position(position.line, position.column) if position is not None else None
+
+        clone_root = None
+        stack = [(root, None)]
+        while stack:
+            node, parent = stack.pop()
+            start, end = clone_position(node.start), clone_position(node.end)
+            if isinstance(node, HDDQuantifier):
+                clone = HDDQuantifier(start=start, end=end)
+            elif isinstance(node, HDDRule):
+                clone = HDDRule(node.name, start=start, end=end, replace=node.replace)
+                clone.recursive_rule = node.recursive_rule
+            elif isinstance(node, HDDErrorToken):
+                clone = HDDErrorToken(node.text, start=start, end=end)
+            else:
+                clone = type(node)(node.name, node.text, start=start, end=end, replace=node.replace)
+
+            if parent is None:
+                clone_root = clone
+            else:
+                parent.add_child(clone)
+            if isinstance(node, HDDRule):
+                stack.extend((child, clone) for child in reversed(node.children))
+        return clone_root
+
+    def build_island_subtree(node, intervals, island_roots):
         """
         Process terminal with an island grammar.
 
         :param node: HDDToken object containing island language.
+        :param intervals: The parts of the terminal that belong to island
+            languages (as returned by find_island_intervals).
+        :param island_roots: Iterator over the HDD trees built from the parts
+            of the terminal.
         :return: List of HDDTree nodes representing the `children` of node.
         """
         last_processed = 0
         content = node.text
         children = []
 
-        # Intervals describes a non-overlapping splitting of the content according to the pattern.
-        intervals = []
-        for m in re.finditer(pattern, content):
-            intervals.extend((g, m.start(g), m.end(g)) for g in list(pattern.groupindex.keys()) if m.start(g) != m.end(g))
-        intervals.sort(key=lambda x: (x[1], x[2]))
-
         def shift_positions(node, start):
-            if node.start:
-                node.start.shift(start)
-            if node.end:
-                node.end.shift(start)
-
-            if isinstance(node, HDDRule):
-                for child in node.children:
-                    shift_positions(child, start)
-
-        for interval in intervals:
-            # Create simple HDDToken of the substring proceeding a subgroup.
-            if last_processed < interval[1]:
-                token_start = node.start.after(content[0:last_processed])
-                token_text = content[last_processed:interval[1]]
+            stack = [node]
+            while stack:
+                node = stack.pop()
+                if node.start:
+                    node.start.shift(start)
+                if node.end:
+                    node.end.shift(start)
+
+                if isinstance(node, HDDRule):
+                    stack.extend(node.children)
+
+        # Positions in the content are computed incrementally from the
+        # previously computed one, instead of scanning the content from its
+        # beginning every time.
+        cursor_offset, cursor = 0, node.start
+
+        def position_at(offset):
+            nonlocal cursor_offset, cursor
+            if offset < cursor_offset:
+                cursor_offset, cursor = 0, node.start
+            cursor = cursor.after(content[cursor_offset:offset])
+            cursor_offset = offset
+            return cursor
+
+        for start, end, _, _ in intervals:
+            # Create simple HDDToken of the substring proceeding a subgroup. It
+            # ends where the island starts, so the end position is computed
+            # only once.
+            token_start = position_at(last_processed) if last_processed < start else None
+            island_start = position_at(start)
+            if token_start:
+                token_text = content[last_processed:start]
                 children.append(HDDToken('', token_text,
                                          start=token_start,
-                                         end=token_start.after(token_text),
+                                         end=island_start,
                                          replace=token_text))
 
-            # Process an island and save its subtree.
-            island_start = node.start.after(content[0:interval[1]])
-            island_root = build_hdd_tree(src=content[interval[1]:interval[2]],
-                                         grammar_name=mapping[interval[0]][0],
-                                         start_rule=mapping[interval[0]][1])
+            # Save the subtree of the island.
+            island_root = next(island_roots)
             shift_positions(island_root, island_start)
             children.append(island_root)
 
-            last_processed = interval[2]
+            last_processed = end
 
         # Create simple HDDToken of the substring following the last subgroup if any.
         if last_processed < len(content):
-            token_start = node.start.after(content[0:last_processed])
+            token_start = position_at(last_processed)
             token_text = content[last_processed:]
             children.append(HDDToken('', token_text,
                                      start=token_start,
@@ -495,107 +892,32 @@ def create_hdd_tree(src, *,
         return children
 
     def calculate_rule_boundaries(node):
-        if isinstance(node, HDDRule):
-            for child in node.children:
-                calculate_rule_boundaries(child)
-
-            node.start = node.children[0].start
-            node.end = node.children[-1].end
+        # Collect the rules in pre-order (with an explicit stack to avoid deep
+        # recursion), then process them in reverse order so that the boundaries
+        # of the children are always known when their parent is processed.
+        rules = []
+        stack = [node]
+        while stack:
+            rule = stack.pop()
+            if isinstance(rule, HDDRule):
+                rules.append(rule)
+                stack.extend(rule.children)
+
+        for rule in reversed(rules):
+            rule.start = rule.children[0].start
+            rule.end = rule.children[-1].end
 
         return node
 
-    def remove_hidden_tokens(node):
-        if isinstance(node, HDDRule):
-            non_hidden_children = []
-
-            for child in node.children:
-                if not isinstance(child, HDDHiddenToken):
-                    remove_hidden_tokens(child)
-                    non_hidden_children.append(child)
-
-            node.children[:] = non_hidden_children
-
-        return node
-
-    _NAMED_GRP_PATTERN = re.compile(r'(?<!\\)(\(\?P<[^>]*>)')   # "(?P<NAME>" not prefixed by a "\"
-    _NAMED_GRP_PREFIX = '(?P<'
-    _NAMED_GRP_SUFFIX = '>'
-    _NAMED_REF_PATTERN = re.compile(r'(?<!\\)(\(\?P=[^)]*\))')  # "(?P=NAME)" not prefixed by a "\"
-    _NAMED_REF_PREFIX = '(?P='
-    _NAMED_REF_SUFFIX = ')'
-
-    def rename_regex_groups(pattern):
-        """
-        Rewrite capture group names in a regex pattern to ensure that the names
-        are valid Python identifiers (as expected by the ``re`` module). This
-        enables more sophisticated capture group names than allowed by default.
-
-        :param str pattern: the original regex pattern with potentially extended
-            syntax for capture group names.
-        :return: the rewritten regex pattern and a mapping from the newly
-            introduced capture group names (which are guaranteed to by valid
-            Python identifiers) to the names used in the original pattern.
-        :rtype: tuple(str, dict(str, str))
-
-        .. note::
-
-           The function expects ``pattern`` to be syntactically valid. Its
-           behavior is undefined for erroneous input.
-        """
-
-        grp_rewritten = ''
-        mapping = {}
-        rmapping = {}
-        cnt = 1
-        for item in _NAMED_GRP_PATTERN.split(pattern):
-            if _NAMED_GRP_PATTERN.match(item):
-                old_name = item[len(_NAMED_GRP_PREFIX):-len(_NAMED_GRP_SUFFIX)]
-                new_name = 'G' + str(cnt)
-                cnt += 1
-
-                mapping[new_name] = old_name
-                rmapping[old_name] = new_name
-
-                item = _NAMED_GRP_PREFIX + new_name + _NAMED_GRP_SUFFIX
-
-            grp_rewritten += item
-
-        ref_rewritten = ''
-        for item in _NAMED_REF_PATTERN.split(grp_rewritten):
-            if _NAMED_REF_PATTERN.match(item):
-                old_name = item[len(_NAMED_REF_PREFIX):-len(_NAMED_REF_SUFFIX)]
-                new_name = rmapping.get(old_name, old_name)
-
-                item = _NAMED_REF_PREFIX + new_name + _NAMED_REF_SUFFIX
-
-            ref_rewritten += item
-
-        return ref_rewritten, mapping
-
-    def split_grammar_rule_name(name):
-        """
-        Determine the grammar and the rule parts in a potentially
-        grammar-prefixed rule name. The syntax for the prefixed format is
-        "[grammar:]rule", where "[]" denote optionality and the default for a
-        missing grammar part is the empty string.
-
-        :param str name: a potentially grammar-prefixed rule name.
-        :return: a 2-tuple of the grammar and the rule name parts.
-        :rtype: tuple(str, str)
-        """
-
-        names = name.split(':', 1)
-        if len(names) < 2:
-            names.insert(0, '')
-        return names[0], names[1]
-
     start_grammar, start_rule = split_grammar_rule_name(start)
-    prepare_parsing(start_grammar)
-    tree = build_hdd_tree(src=src,
-                          grammar_name=start_grammar,
-                          start_rule=start_rule)
-    if not hidden_tokens:
-        tree = remove_hidden_tokens(tree)
+    try:
+        prepare_parsing(start_grammar)
+        tree = build_hdd_tree(src=src,
+                              grammar_name=start_grammar,
+                              start_rule=start_rule)
+    finally:
+        for process in java_processes:
+            process.close()
     tree = remove_empty_nodes(tree)
     tree = calculate_rule_boundaries(tree)
     return tree
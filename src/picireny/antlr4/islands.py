@@ -0,0 +1,85 @@
+# Copyright (c) 2016-2023 Renata Hodovan, Akos Kiss.
+#
+# Licensed under the BSD 3-Clause License
+# <LICENSE.rst or https://opensource.org/licenses/BSD-3-Clause>.
+# This file may not be copied, modified, or distributed except
+# according to those terms.
+
+import re
+
+from functools import lru_cache
+
+
+# "(?P<NAME>" or "(?P=NAME)" not prefixed by a "\"
+_NAMED_GRP_OR_REF_PATTERN = re.compile(r'(?<!\\)\(\?P(?:<(?P<grp>[^>]*)>|=(?P<ref>[^)]*)\))')
+
+
+def rename_regex_groups(pattern):
+    """
+    Rewrite capture group names in a regex pattern to ensure that the names
+    are valid Python identifiers (as expected by the ``re`` module). This
+    enables more sophisticated capture group names than allowed by default.
+
+    :param str pattern: the original regex pattern with potentially extended
+        syntax for capture group names.
+    :return: the rewritten regex pattern and a mapping from the newly
+        introduced capture group names (which are guaranteed to by valid
+        Python identifiers) to the names used in the original pattern.
+    :rtype: tuple(str, dict(str, str))
+
+    .. note::
+
+       The function expects ``pattern`` to be syntactically valid. Its
+       behavior is undefined for erroneous input.
+    """
+
+    mapping = {}
+    rmapping = {}
+
+    def rename(m):
+        old_name = m.group('grp')
+        if old_name is not None:
+            new_name = f'G{len(mapping) + 1}'
+            mapping[new_name] = old_name
+            rmapping[old_name] = new_name
+            return f'(?P<{new_name}>'
+
+        old_name = m.group('ref')
+        return f'(?P={rmapping.get(old_name, old_name)})'
+
+    return _NAMED_GRP_OR_REF_PATTERN.sub(rename, pattern), mapping
+
+
+def split_grammar_rule_name(name):
+    """
+    Determine the grammar and the rule parts in a potentially
+    grammar-prefixed rule name. The syntax for the prefixed format is
+    "[grammar:]rule", where "[]" denote optionality and the default for a
+    missing grammar part is the empty string.
+
+    :param str name: a potentially grammar-prefixed rule name.
+    :return: a 2-tuple of the grammar and the rule name parts.
+    :rtype: tuple(str, str)
+    """
+
+    names = name.split(':', 1)
+    if len(names) < 2:
+        names.insert(0, '')
+    return names[0], names[1]
+
+
+@lru_cache(maxsize=256)
+def compile_island_pattern(pattern):
+    """
+    Compile an island pattern and resolve the grammar and rule names of its
+    groups, so that matches can be processed by group numbers. Identical
+    patterns (e.g., of grammars prepared again by subsequent builds) share the
+    result.
+
+    :param pattern: The island pattern with extended capture group names.
+    :return: The compiled pattern and a tuple of (group number, grammar name,
+        rule name) triplets describing its groups.
+    """
+    rewritten, mapping = rename_regex_groups(pattern)
+    compiled = re.compile(rewritten, re.S)
+    return compiled, tuple((num, *split_grammar_rule_name(mapping[group])) for group, num in compiled.groupindex.items())
@@ -0,0 +1,105 @@
+# Copyright (c) 2016-2023 Renata Hodovan, Akos Kiss.
+#
+# Licensed under the BSD 3-Clause License
+# <LICENSE.rst or https://opensource.org/licenses/BSD-3-Clause>.
+# This file may not be copied, modified, or distributed except
+# according to those terms.
+
+import logging
+
+from functools import lru_cache
+from os import pathsep
+from subprocess import CalledProcessError, PIPE, Popen, run, STDOUT
+from threading import Lock, Thread
+
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=32)
+def java_classpath(antlr, current_workdir):
+    """
+    Compute the classpath of the Java parser of a grammar.
+
+    :param antlr: Path to the ANTLR4 tool (Java jar binary).
+    :param current_workdir: Working directory of the grammar.
+    :return: The classpath.
+    """
+    return pathsep.join([antlr, current_workdir])
+
+
+@lru_cache(maxsize=1)
+def javac_version():
+    """
+    Determine the version of the Java compiler.
+
+    :return: The version info printed by the compiler.
+    """
+    return run(('javac', '-version'), stdout=PIPE, stderr=STDOUT, check=True).stdout
+
+
+class JavaParserProcess:
+    """
+    Long-running Java parser process of a grammar. Starting a JVM is expensive,
+    so a single process serves all the parse requests of a grammar (e.g., of
+    all the occurrences of an island language), which also lets the DFA cache
+    of the parser warm up across requests.
+    """
+
+    def __init__(self, args, cwd):
+        """
+        Start the parser process.
+
+        :param args: Command line of the parser process.
+        :param cwd: Working directory of the parser process.
+        """
+        self.args = args
+        # The process serves requests until close() is called, so it cannot be
+        # managed by a with statement.
+        self.proc = Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=cwd)  # pylint: disable=consider-using-with
+        self.lock = Lock()
+        # The parser reports syntax errors on its standard error, which must be
+        # consumed continuously, otherwise the process blocks on a full pipe.
+        Thread(target=self._log_stderr, daemon=True).start()
+
+    def _log_stderr(self):
+        for line in self.proc.stderr:
+            logger.debug('%s', line.decode('utf-8', errors='replace').rstrip())
+
+    def _read(self, size):
+        data = self.proc.stdout.read(size)
+        if len(data) != size:
+            raise CalledProcessError(self.proc.wait(), self.args)
+        return data
+
+    def parse(self, src, start_rule):
+        """
+        Parse the input with the parser process.
+
+        :param src: Input source.
+        :param start_rule: The name of the start rule of the parser.
+        :return: The binary dump of the HDD tree built by the parser.
+        """
+        with self.lock:
+            try:
+                for frame in (start_rule.encode('utf-8'), src.encode('utf-8')):
+                    self.proc.stdin.write(len(frame).to_bytes(4, 'big'))
+                    self.proc.stdin.write(frame)
+                self.proc.stdin.flush()
+            except BrokenPipeError as e:
+                raise CalledProcessError(self.proc.wait(), self.args) from e
+
+            size = int.from_bytes(self._read(4), 'big', signed=True)
+            if size < 0:
+                # The parser failed but the process is still alive, report the
+                # failure the same way as if the process exited with an error.
+                raise CalledProcessError(1, self.args, output='', stderr=self._read(-size).decode('utf-8', errors='replace'))
+            return self._read(size)
+
+    def close(self):
+        """
+        Stop the parser process by closing its input.
+        """
+        if self.proc.poll() is None:
+            self.proc.stdin.close()
+            self.proc.wait()
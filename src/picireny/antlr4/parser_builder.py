@@ -5,17 +5,108 @@
 # This file may not be copied, modified, or distributed except
 # according to those terms.
 
+import hashlib
 import logging
+import sys
 
+from importlib.util import module_from_spec, spec_from_file_location
 from os import listdir
-from os.path import basename, commonprefix, split, splitext
+from os.path import abspath, basename, join, splitext
 from subprocess import CalledProcessError, PIPE, run, STDOUT
+from threading import Lock
 
 logger = logging.getLogger(__name__)
 grammar_cache = {}
 
+# The state of the embedded JVM: the ANTLR4 tool it has been started with, if
+# any.
+_jvm = {'antlr': None}
+_jvm_lock = Lock()
 
-def build_grammars(grammars, out, antlr, lang='python'):
+
+def run_antlr(antlr, args, cwd, embedded=False):
+    """
+    Run the ANTLR4 tool. By default, every run starts a new JVM process. If
+    requested, the tool runs in a JVM embedded into the current process (with
+    JPype), which is started only once and is reused for all grammars.
+
+    :param antlr: Path to the ANTLR4 tool (Java jar binary).
+    :param args: Tuple of command line arguments of the tool. Paths must be
+        absolute, as the embedded JVM does not know about cwd.
+    :param cwd: Working directory of the tool.
+    :param embedded: Run the tool in an embedded JVM.
+    """
+    if embedded:
+        # JPype (and its native extension) is only loaded if it is used.
+        import jpype
+
+        with _jvm_lock:
+            if not jpype.isJVMStarted():
+                jpype.startJVM(classpath=[antlr])
+                _jvm['antlr'] = antlr
+
+            # A JVM started by someone else, or with another ANTLR4 tool on its
+            # classpath cannot be used.
+            if _jvm['antlr'] == antlr:
+                run_embedded_antlr(args)
+                return
+
+    run(('java', '-jar', antlr) + args, stdout=PIPE, stderr=STDOUT, cwd=cwd, check=True)
+
+
+def run_embedded_antlr(args):
+    """
+    Run the ANTLR4 tool in the embedded JVM. The messages of the tool are
+    collected (instead of being printed to the standard streams of the
+    process), so that they can be reported the same way as the output of a
+    tool run in a JVM process.
+
+    :param args: Tuple of command line arguments of the tool.
+    """
+    import jpype
+
+    system = jpype.JClass('java.lang.System')
+    output = jpype.JClass('java.io.ByteArrayOutputStream')()
+    stream = jpype.JClass('java.io.PrintStream')(output, True, 'UTF-8')
+    stdout, stderr = system.out, system.err
+    system.setOut(stream)
+    system.setErr(stream)
+    try:
+        tool = jpype.JClass('org.antlr.v4.Tool')(jpype.JArray(jpype.JString)(list(args)))
+        tool.processGrammarsOnCommandLine()
+    finally:
+        system.setOut(stdout)
+        system.setErr(stderr)
+
+    if tool.getNumErrors() > 0:
+        raise CalledProcessError(1, ('antlr',) + args, output=str(output.toString('UTF-8')).encode('utf-8'))
+
+
+def grammar_key(grammars, resources, out):
+    """
+    Compute the key of grammars in the grammar cache. The built grammars are
+    only shared if both their content and their output directory are the same,
+    as their generated files are expected to be found in the output directory
+    (e.g., by the Java parser or by the cache of prepared grammars). The other
+    files of the grammars are part of the key, too, as they may change the
+    meaning of grammars with identical content (e.g., the superclasses of the
+    generated lexers and parsers).
+
+    :param grammars: Tuple of grammar files.
+    :param resources: Tuple of the other files needed by the grammars.
+    :param out: Output directory of the build.
+    :return: The cache key of the grammars.
+    """
+    digest = hashlib.sha256()
+    for fn in grammars + resources:
+        with open(fn, 'rb') as f:
+            content = f.read()
+        digest.update(f'{basename(fn)}\0{len(content)}\0'.encode('utf-8'))
+        digest.update(content)
+    return digest.hexdigest(), abspath(out)
+
+
+def build_grammars(grammars, out, antlr, lang='python', embedded_antlr=False, resources=()):
     """
     Build lexer and grammar from ANTLRv4 grammar files in Python target.
 
@@ -23,17 +114,19 @@ def build_grammars(grammars, out, antlr, lang='python'):
     :param out: Output directory.
     :param antlr: Path to the ANTLR4 tool (Java jar binary).
     :param lang: The target language of the parser.
+    :param embedded_antlr: Run the ANTLR4 tool in an embedded JVM.
+    :param resources: Tuple of the other files needed by the grammars.
     :return: List of references/names of the lexer, parser and listener classes
         of the target.
     """
 
     # Generate parser and lexer in the target language and return either with
     # python class ref or the name of java classes.
-    if lang not in grammar_cache:
-        grammar_cache[lang] = {}
-    if grammars in grammar_cache[lang]:
+    lang_cache = grammar_cache.setdefault(lang, {})
+    key = grammar_key(grammars, resources, out)
+    if key in lang_cache:
         logger.debug('%r is already built with %s target.', grammars, lang)
-        return grammar_cache[lang][grammars]
+        return lang_cache[key]
 
     try:
         languages = {
@@ -42,33 +135,71 @@ def build_grammars(grammars, out, antlr, lang='python'):
         }
 
         try:
-            run(('java', '-jar', antlr, languages[lang]['antlr_arg'], '-o', out) + grammars,
-                stdout=PIPE, stderr=STDOUT, cwd=out, check=True)
+            run_antlr(antlr, (languages[lang]['antlr_arg'], '-o', abspath(out), '-lib', abspath(out)) + tuple(abspath(g) for g in grammars), cwd=out, embedded=embedded_antlr)
         except CalledProcessError as e:
-            logger.error('Building grammars %r failed!\n%s\n', grammars, e.output)
+            logger.error('Building grammars %r failed!\n%s\n', grammars, e.output.decode(errors='replace'))
             raise
 
-        files = listdir(out)
         filename = basename(grammars[0])
+        ext = languages[lang]['ext']
+        # The name of the generated listeners differs if Python or other language target is used.
+        suffixes = (f'Lexer.{ext}', f'Parser.{ext}', f'{languages[lang]["listener_format"]}.{ext}')
 
-        def file_endswith(end_pattern):
-            f = next(f for f in files if len(commonprefix([filename, f])) > 0 and f.endswith(end_pattern))
-            _, f = split(f)
-            f, _ = splitext(f)
-            return f
+        # Extract the name of lexer, parser and listener from the names of the
+        # generated files (sharing a prefix with the grammar) in one pass.
+        names = {}
+        for f in listdir(out):
+            if f[:1] == filename[:1]:
+                for suffix in suffixes:
+                    if suffix not in names and f.endswith(suffix):
+                        names[suffix] = splitext(f)[0]
+        lexer, parser, listener = (names[suffix] for suffix in suffixes)
+    except Exception as e:
+        logger.error('Exception while loading parser modules', exc_info=e)
+        raise
+
+    return load_grammars(grammars, out, [lexer, parser, listener], lang, resources)
+
+
+def load_module(name, out):
+    """
+    Load a generated Python module from its known location, without searching
+    sys.path. The module is registered in sys.modules, as other generated
+    modules import it by name.
+
+    :param name: Name of the module.
+    :param out: Directory of the module.
+    :return: The loaded module.
+    """
+    spec = spec_from_file_location(name, join(out, f'{name}.py'))
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
-        # Extract the name of lexer and parser from their path.
-        lexer = file_endswith(f'Lexer.{languages[lang]["ext"]}')
-        parser = file_endswith(f'Parser.{languages[lang]["ext"]}')
-        # The name of the generated listeners differs if Python or other language target is used.
-        listener = file_endswith(f'{languages[lang]["listener_format"]}.{languages[lang]["ext"]}')
 
+def load_grammars(grammars, out, names, lang='python', resources=()):
+    """
+    Load lexer and grammar already built from ANTLRv4 grammar files.
+
+    :param grammars: Tuple of grammar files.
+    :param out: Output directory of the build.
+    :param names: List of the names of the lexer, parser and listener classes
+        of the target.
+    :param lang: The target language of the parser.
+    :param resources: Tuple of the other files needed by the grammars.
+    :return: List of references/names of the lexer, parser and listener classes
+        of the target.
+    """
+    lang_cache = grammar_cache.setdefault(lang, {})
+    key = grammar_key(grammars, resources, out)
+    try:
         if lang == 'python':
-            grammar_cache[lang][grammars] = [getattr(__import__(x, globals(), locals(), [x], 0), x) for x in [lexer, parser, listener]]
+            lang_cache[key] = [getattr(load_module(x, out), x) for x in names]
         else:
-            grammar_cache[lang][grammars] = [lexer, parser, listener]
-
-        return grammar_cache[lang][grammars]
+            lang_cache[key] = list(names)
     except Exception as e:
         logger.error('Exception while loading parser modules', exc_info=e)
         raise
+
+    return lang_cache[key]
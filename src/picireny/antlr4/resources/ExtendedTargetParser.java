@@ -8,12 +8,15 @@
  */
 
 import java.io.*;
+import java.lang.reflect.InvocationTargetException;
+import java.nio.charset.StandardCharsets;
 import java.util.*;
-import javax.xml.stream.*;
 
 import org.antlr.v4.runtime.*;
+import org.antlr.v4.runtime.atn.PredictionMode;
 import org.antlr.v4.runtime.tree.*;
 import org.antlr.v4.runtime.misc.Pair;
+import org.antlr.v4.runtime.misc.ParseCancellationException;
 
 
 /**
@@ -45,84 +48,112 @@ public class Extended$parser_class extends $parser_class {
         }
     }
 
+    /**
+     * Serve parse requests until the standard input is closed. A request
+     * consists of the name of the start rule and the input to parse, both
+     * prefixed by their length in bytes. The response is the dumped HDD tree
+     * prefixed by its length, or the stack trace of the failure prefixed by
+     * its negated length.
+     *
+     * The HDD tree is dumped in pre-order. Every node starts with a byte
+     * identifying its type, followed by the name of rules and tokens, the text
+     * of tokens, the line and column of the start and end of tokens, and the
+     * number of children of rules. Numbers are 4-byte big-endian integers and
+     * strings are UTF-8 encoded and prefixed by their length in bytes.
+     */
     public static void main(String[] args) {
+        boolean hidden_tokens = args.length > 0 && Boolean.parseBoolean(args[0]);
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        DataOutputStream out = new DataOutputStream(new BufferedOutputStream(System.out));
+
         try {
-            ExtendedTargetLexer lexer = new ExtendedTargetLexer(CharStreams.fromStream(System.in));
-            lexer.addErrorListener(new ExtendedErrorListener());
-            CommonTokenStream tokens = new CommonTokenStream(lexer);
-            Extended$parser_class parser = new Extended$parser_class(tokens);
-            ExtendedTargetListener listener = new ExtendedTargetListener(parser);
-
-            parser.addParseListener(listener);
-            Extended$parser_class.class.getMethod(args[0]).invoke(parser);
-            parser.syntaxErrorWarning();
-
-            try (XsonStreamWriter w = new XsonStreamWriter(System.out)) {
-                w.write(null, listener.root);
+            while (true) {
+                String start_rule;
+                try {
+                    start_rule = readFrame(in);
+                } catch (EOFException e) {
+                    break;
+                }
+                String src = readFrame(in);
+
+                ByteArrayOutputStream result = new ByteArrayOutputStream();
+                try {
+                    parse(src, start_rule, hidden_tokens, result);
+                    out.writeInt(result.size());
+                } catch (Exception e) {
+                    result.reset();
+                    e.printStackTrace(new PrintStream(result, true, "UTF-8"));
+                    out.writeInt(-result.size());
+                }
+                result.writeTo(out);
+                out.flush();
             }
-        } catch(Exception e) {
+        } catch (IOException e) {
             e.printStackTrace(System.err);
             System.exit(1);
         }
     }
 
-    private static interface XsonObject {
-        public void writeXsonMembers(XsonStreamWriter w) throws XMLStreamException;
+    private static String readFrame(DataInputStream in) throws IOException {
+        byte[] frame = new byte[in.readInt()];
+        in.readFully(frame);
+        return new String(frame, StandardCharsets.UTF_8);
     }
 
-    /**
-     * XsonStreamWriter is a partial implementation for writing JSONx documents.
-     * It only implements the minimum required to dump HDDNode objects.
-     */
-    private static class XsonStreamWriter implements AutoCloseable {
-        public static final String JSONX_PREFIX = "json";
-        public static final String JSONX_NS_URI = "http://www.ibm.com/xmlns/prod/2009/jsonx";
-
-        private XMLStreamWriter w;
-
-        public XsonStreamWriter(OutputStream o) throws XMLStreamException {
-            XMLOutputFactory factory = XMLOutputFactory.newInstance();
-            factory.setProperty(XMLOutputFactory.IS_REPAIRING_NAMESPACES, true);
-            w = factory.createXMLStreamWriter(o);
-            w.setPrefix(JSONX_PREFIX, JSONX_NS_URI);
-        }
-
-        public void write(String name, XsonObject value) throws XMLStreamException {
-            w.writeStartElement(JSONX_PREFIX, "object", JSONX_NS_URI);
-            if (name != null)
-                w.writeAttribute("name", name);
-            value.writeXsonMembers(this);
-            w.writeEndElement();
-        }
-
-        public void write(String name, Iterable<? extends XsonObject> value) throws XMLStreamException {
-            w.writeStartElement(JSONX_PREFIX, "array", JSONX_NS_URI);
-            if (name != null)
-                w.writeAttribute("name", name);
-            for (XsonObject o : value)
-                write(null, o);
-            w.writeEndElement();
+    private static void parse(String src, String start_rule, boolean hidden_tokens, OutputStream o) throws Exception {
+        ExtendedTargetLexer lexer = new ExtendedTargetLexer(CharStreams.fromString(src));
+        lexer.addErrorListener(new ExtendedErrorListener());
+        CommonTokenStream tokens = new CommonTokenStream(lexer);
+        Extended$parser_class parser = new Extended$parser_class(tokens);
+
+        // The HDD tree is built by the parse listener, no parse tree is needed.
+        parser.setBuildParseTree(false);
+
+        // Two-stage parsing: try the faster SLL prediction first, which either
+        // yields the same result as full LL prediction or fails (with a syntax
+        // error that is either real or caused by the weakness of SLL). Only
+        // reparse with LL (and with error recovery) if SLL fails. Syntax errors
+        // are not reported in the first stage.
+        ExtendedTargetListener listener;
+        parser.removeErrorListeners();
+        try {
+            listener = runParser(parser, start_rule, hidden_tokens, PredictionMode.SLL, new BailErrorStrategy());
+        } catch (ParseCancellationException e) {
+            parser.addErrorListener(ConsoleErrorListener.INSTANCE);
+            listener = runParser(parser, start_rule, hidden_tokens, PredictionMode.LL, new DefaultErrorStrategy());
         }
+        parser.syntaxErrorWarning();
 
-        public void write(String name, int value) throws XMLStreamException {
-            w.writeStartElement(JSONX_PREFIX, "number", JSONX_NS_URI);
-            if (name != null)
-                w.writeAttribute("name", name);
-            w.writeCharacters(Integer.toString(value));
-            w.writeEndElement();
-        }
+        DataOutputStream w = new DataOutputStream(new BufferedOutputStream(o));
+        listener.root.write(w);
+        w.flush();
+    }
 
-        public void write(String name, String value) throws XMLStreamException {
-            w.writeStartElement(JSONX_PREFIX, "string", JSONX_NS_URI);
-            if (name != null)
-                w.writeAttribute("name", name);
-            w.writeCharacters(value);
-            w.writeEndElement();
+    private static ExtendedTargetListener runParser(Extended$parser_class parser, String start_rule, boolean hidden_tokens,
+                                                    PredictionMode prediction_mode, ANTLRErrorStrategy error_strategy) throws Exception {
+        parser.reset();
+        parser.getInterpreter().setPredictionMode(prediction_mode);
+        parser.setErrorHandler(error_strategy);
+        ExtendedTargetListener listener = new ExtendedTargetListener(parser, hidden_tokens);
+        parser.addParseListener(listener);
+        try {
+            Extended$parser_class.class.getMethod(start_rule).invoke(parser);
+        } catch (InvocationTargetException e) {
+            // Let the caller see the exceptions of the start rule, e.g., the
+            // cancellation of SLL parsing.
+            if (e.getCause() instanceof Exception)
+                throw (Exception)e.getCause();
+            throw e;
+        } finally {
+            parser.removeParseListener(listener);
         }
+        return listener;
+    }
 
-        public void close() throws XMLStreamException {
-            w.close();
-        }
+    private static void writeString(DataOutputStream w, String value) throws IOException {
+        byte[] bytes = value.getBytes(StandardCharsets.UTF_8);
+        w.writeInt(bytes.length);
+        w.write(bytes);
     }
 
     /**
@@ -154,12 +185,20 @@ public class Extended$parser_class extends $parser_class {
      */
     private static class ExtendedTargetListener extends $listener_class {
 
+        // Node types in the dump of the HDD tree.
+        private static final int RULE = 0;
+        private static final int QUANTIFIER = 1;
+        private static final int TOKEN = 2;
+        private static final int HIDDEN_TOKEN = 3;
+        private static final int ERROR_TOKEN = 4;
+
         private HDDRule current_node;
         private Parser parser;
         private HDDRule root;
         private boolean seen_terminal;
+        private boolean hidden_tokens;
 
-        private static class Position implements XsonObject {
+        private static class Position {
             public int line;
             public int column;
 
@@ -186,13 +225,13 @@ public class Extended$parser_class extends $parser_class {
                 }
             }
 
-            public void writeXsonMembers(XsonStreamWriter w) throws XMLStreamException {
-                w.write("line", line);
-                w.write("column", column);
+            public void write(DataOutputStream w) throws IOException {
+                w.writeInt(line);
+                w.writeInt(column);
             }
         }
 
-        private static abstract class HDDNode implements XsonObject {
+        private static abstract class HDDNode {
             public String name;
             public HDDRule parent;
             public Position start;
@@ -205,15 +244,7 @@ public class Extended$parser_class extends $parser_class {
                 end = null;
             }
 
-            public void writeXsonMembers(XsonStreamWriter w) throws XMLStreamException {
-                w.write("type", getClass().getSimpleName());
-                if (name != null)
-                    w.write("name", name);
-                if (start != null)
-                    w.write("start", start);
-                if (end != null)
-                    w.write("end", end);
-            }
+            public abstract void write(DataOutputStream w) throws IOException;
         }
 
         private static class HDDRule extends HDDNode {
@@ -231,9 +262,16 @@ public class Extended$parser_class extends $parser_class {
                 node.parent = this;
             }
 
-            public void writeXsonMembers(XsonStreamWriter w) throws XMLStreamException {
-                super.writeXsonMembers(w);
-                w.write("children", children);
+            public void write(DataOutputStream w) throws IOException {
+                w.writeByte(RULE);
+                writeString(w, name);
+                writeChildren(w);
+            }
+
+            protected void writeChildren(DataOutputStream w) throws IOException {
+                w.writeInt(children.size());
+                for (HDDNode child : children)
+                    child.write(w);
             }
         }
 
@@ -247,9 +285,16 @@ public class Extended$parser_class extends $parser_class {
                 end = _end;
             }
 
-            public void writeXsonMembers(XsonStreamWriter w) throws XMLStreamException {
-                super.writeXsonMembers(w);
-                w.write("text", text);
+            public void write(DataOutputStream w) throws IOException {
+                w.writeByte(TOKEN);
+                writeString(w, name);
+                writeText(w);
+            }
+
+            protected void writeText(DataOutputStream w) throws IOException {
+                writeString(w, text);
+                start.write(w);
+                end.write(w);
             }
         }
 
@@ -257,25 +302,42 @@ public class Extended$parser_class extends $parser_class {
             public HDDQuantifier() {
                 super(null);
             }
+
+            public void write(DataOutputStream w) throws IOException {
+                w.writeByte(QUANTIFIER);
+                writeChildren(w);
+            }
         }
 
         private static class HDDHiddenToken extends HDDToken {
             public HDDHiddenToken(String _name, String _text, Position _start, Position _end) {
                 super(_name, _text, _start, _end);
             }
+
+            public void write(DataOutputStream w) throws IOException {
+                w.writeByte(HIDDEN_TOKEN);
+                writeString(w, name);
+                writeText(w);
+            }
         }
 
         private static class HDDErrorToken extends HDDToken {
             public HDDErrorToken(String _text, Position _start, Position _end) {
                 super(null, _text, _start, _end);
             }
+
+            public void write(DataOutputStream w) throws IOException {
+                w.writeByte(ERROR_TOKEN);
+                writeText(w);
+            }
         }
 
-        public ExtendedTargetListener(Parser _parser) {
+        public ExtendedTargetListener(Parser _parser, boolean _hidden_tokens) {
             parser = _parser;
             current_node = null;
             root = null;
             seen_terminal = false;
+            hidden_tokens = _hidden_tokens;
         }
 
         public void recursion_enter() {
@@ -336,7 +398,7 @@ public class Extended$parser_class extends $parser_class {
         }
 
         private void addToken(TerminalNode node, HDDToken child) {
-            if (!seen_terminal) {
+            if (hidden_tokens && !seen_terminal) {
                 List<Token> hiddenTokens = ((BufferedTokenStream)parser.getTokenStream()).getHiddenTokensToLeft(node.getSymbol().getTokenIndex(), -1);
                 if (hiddenTokens != null) {
                     for (Token token : hiddenTokens) {
@@ -349,11 +411,13 @@ public class Extended$parser_class extends $parser_class {
 
             current_node.addChild(child);
 
-            List<Token> hiddenTokens = ((BufferedTokenStream)parser.getTokenStream()).getHiddenTokensToRight(node.getSymbol().getTokenIndex(), -1);
-            if (hiddenTokens != null) {
-                for (Token token : hiddenTokens) {
-                    Position[] boundaries = tokenBoundaries(token);
-                    current_node.addChild(new HDDHiddenToken(parser.getTokenNames()[token.getType()], token.getText(), boundaries[0], boundaries[1]));
+            if (hidden_tokens) {
+                List<Token> hiddenTokens = ((BufferedTokenStream)parser.getTokenStream()).getHiddenTokensToRight(node.getSymbol().getTokenIndex(), -1);
+                if (hiddenTokens != null) {
+                    for (Token token : hiddenTokens) {
+                        Position[] boundaries = tokenBoundaries(token);
+                        current_node.addChild(new HDDHiddenToken(parser.getTokenNames()[token.getType()], token.getText(), boundaries[0], boundaries[1]));
+                    }
                 }
             }
         }
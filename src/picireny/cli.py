@@ -9,7 +9,8 @@ import json
 
 from argparse import ArgumentParser
 from importlib import metadata
-from os.path import abspath, dirname, exists, join, realpath
+from os import environ
+from os.path import abspath, dirname, exists, expanduser, join, realpath
 from shutil import rmtree
 
 import antlerinator
@@ -21,7 +22,15 @@ from inators import log as logging
 from . import filter, hdd, hddr, hoist, info, prune, transform
 
 logger = logging.getLogger('picireny')
-__version__ = metadata.version(__package__)
+
+
+def __getattr__(name):
+    # The version is looked up in the package metadata only when it is first
+    # asked for, which is not needed by most users of the module.
+    if name == '__version__':
+        version = globals()['__version__'] = metadata.version(__package__)
+        return version
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 args_hdd_choices = {
@@ -43,28 +52,37 @@ def process_antlr4_args(args):
     antlerinator.process_antlr_argument(args)
     args.antlr = realpath(args.antlr)
 
-    def load_format_config(data):
+    if args.grammar_cache == '':
+        raise ValueError('Invalid grammar cache: The directory must not be empty.')
+
+    def load_format_config(grammars):
         # Interpret relative grammar paths compared to the directory of the config file.
-        if 'files' in data:
-            for i, fn in enumerate(data['files']):
-                path = join(abspath(dirname(args.format)), fn)
-                if not exists(path):
-                    raise ValueError(f'Invalid input format definition: {path}, defined in the format config, does not exist.')
-                data['files'][i] = path
-            data['islands'] = data.get('islands', {})
-            data['replacements'] = data.get('replacements', {})
-        return data
+        format_dir = abspath(dirname(args.format))
+        for data in grammars.values():
+            if 'files' in data:
+                for i, fn in enumerate(data['files']):
+                    path = join(format_dir, fn)
+                    if not exists(path):
+                        raise ValueError(f'Invalid input format definition: {path}, defined in the format config, does not exist.')
+                    data['files'][i] = path
+                data['islands'] = data.get('islands', {})
+                data['replacements'] = data.get('replacements', {})
+        return grammars
 
     args.input_format = {}
 
     if args.format:
-        if not exists(args.format):
-            raise ValueError(f'Invalid input format definition: {args.format} does not exist.')
-
-        with open(args.format, 'r') as f:
+        # Open the config files right away, instead of checking their existence
+        # first, and report if they are missing.
+        try:
+            f = open(args.format, 'r')
+        except FileNotFoundError as e:
+            raise ValueError(f'Invalid input format definition: {args.format} does not exist.') from e
+
+        with f:
             try:
-                input_description = json.load(f, object_hook=load_format_config)
-                args.input_format = input_description['grammars']
+                input_description = json.load(f)
+                args.input_format = load_format_config(input_description['grammars'])
                 if not args.start:
                     args.start = input_description.get('start', None)
             except ValueError as e:
@@ -85,12 +103,11 @@ def process_antlr4_args(args):
                     raise ValueError(f'Invalid input format definition: {args.input_format[""]["files"][i]} does not exist.')
 
         if args.replacements:
-            if not exists(args.replacements):
-                raise ValueError(f'Invalid input format definition: {args.replacements} does not exist.')
-
             try:
                 with open(args.replacements, 'r') as f:
                     args.input_format['']['replacements'] = json.load(f)
+            except FileNotFoundError as e:
+                raise ValueError(f'Invalid input format definition: {args.replacements} does not exist.') from e
             except ValueError as e:
                 raise ValueError(f'Invalid input format definition: The content of {args.replacements} is not a valid JSON object.') from e
 
@@ -127,9 +144,9 @@ def log_tree(title, hdd_tree):
 
 def build_with_antlr4(src, *,
                       input_format, start,
-                      antlr, lang='python',
+                      antlr, lang='python', embedded_antlr=False,
                       build_hidden_tokens=False,
-                      work_dir):
+                      work_dir, cache_dir=None):
     """
     Execute ANTLRv4-based tree building part of picireny as if invoked from
     command line, however, control its behaviour not via command line arguments
@@ -140,22 +157,28 @@ def build_with_antlr4(src, *,
     :param start: Name of the start rule in [grammarname:]rulename format.
     :param antlr: Path to the ANTLR4 tool (Java jar binary).
     :param lang: The target language of the parser.
+    :param embedded_antlr: Run the ANTLR4 tool in a JVM embedded into the
+        current process (needs JPype).
     :param build_hidden_tokens: Build hidden tokens of the input format into the
         HDD tree.
     :param work_dir: Path to a working directory.
+    :param cache_dir: Path to a directory to keep prepared grammars in across
+        runs (default: a subdirectory of work_dir).
     :return: The built HDD tree.
     """
     # Get the parameters in a dictionary so that they can be pretty-printed
-    args = locals().copy()
-    del args['src']
-    picire.cli.log_args('Building tree with ANTLRv4', args)
+    # (but only if they are logged at all, as formatting them is not cheap).
+    if picire.cli.logger.isEnabledFor(logging.INFO):
+        args = locals().copy()
+        del args['src']
+        picire.cli.log_args('Building tree with ANTLRv4', args)
 
     from .antlr4 import create_hdd_tree
     return create_hdd_tree(src,
                            input_format=input_format, start=start,
-                           antlr=antlr, lang=lang,
+                           antlr=antlr, lang=lang, embedded_antlr=embedded_antlr,
                            hidden_tokens=build_hidden_tokens,
-                           work_dir=work_dir)
+                           work_dir=work_dir, cache_dir=cache_dir)
 
 
 def build_with_srcml(src, *, language):
@@ -169,9 +192,11 @@ def build_with_srcml(src, *, language):
     :return: The built HDD tree.
     """
     # Get the parameters in a dictionary so that they can be pretty-printed
-    args = locals().copy()
-    del args['src']
-    picire.cli.log_args('Building tree with srcML', args)
+    # (but only if they are logged at all, as formatting them is not cheap).
+    if picire.cli.logger.isEnabledFor(logging.INFO):
+        args = locals().copy()
+        del args['src']
+        picire.cli.log_args('Building tree with srcML', args)
 
     from .srcml import create_hdd_tree
     return create_hdd_tree(src, language=language)
@@ -212,9 +237,11 @@ def reduce(hdd_tree, *,
     :return: The reduced HDD tree.
     """
     # Get the parameters in a dictionary so that they can be pretty-printed
-    args = locals().copy()
-    del args['hdd_tree']
-    picire.cli.log_args('Reduce session starts', args)
+    # (but only if they are logged at all, as formatting them is not cheap).
+    if picire.cli.logger.isEnabledFor(logging.INFO):
+        args = locals().copy()
+        del args['hdd_tree']
+        picire.cli.log_args('Reduce session starts', args)
 
     log_tree('Initial tree', hdd_tree)
 
@@ -279,7 +306,7 @@ def execute():
     arg_parser.add_argument('--skip-whitespace', dest='skip_whitespace', default=False, action='store_true',
                             help='hide whitespace tokens from the ddmin algorithm')
     inators.arg.add_sys_recursion_limit_argument(arg_parser)
-    inators.arg.add_version_argument(arg_parser, version=__version__)
+    inators.arg.add_version_argument(arg_parser, version=metadata.version(__package__))
 
     # ANTLRv4-specific settings.
     antlr4_grp = arg_parser.add_argument_group('ANTLRv4-specific arguments')
@@ -297,6 +324,15 @@ def execute():
     antlr4_grp.add_argument('--build-hidden-tokens', '--antlr4:build-hidden-tokens', default=False, action='store_true',
                             help='build hidden tokens of the grammar(s) into the HDD tree')
     antlerinator.add_antlr_argument(antlr4_grp, long_alias='--antlr4:antlr')
+    antlr4_grp.add_argument('--embedded-antlr', '--antlr4:embedded-antlr', default=False, action='store_true',
+                            help='run the ANTLR4 tool in a JVM embedded into the current process instead of '
+                                 'starting a new JVM for every grammar (needs JPype)')
+    antlr4_grp.add_argument('--grammar-cache', '--antlr4:grammar-cache', metavar='DIR',
+                            default=join(environ.get('XDG_CACHE_HOME') or join(expanduser('~'), '.cache'), 'picireny', 'grammars'),
+                            help='directory to keep prepared grammars in across runs (default: %(default)s)')
+    antlr4_grp.add_argument('--no-grammar-cache', '--antlr4:no-grammar-cache', dest='grammar_cache', action='store_const', const=None,
+                            help='keep prepared grammars only in the working directory of the run (under the '
+                                 'output directory), not across runs')
     antlr4_grp.add_argument('--parser', '--antlr4:parser', metavar='LANG', default='python', choices=['python', 'java'],
                             help='language of the generated parsers (%(choices)s; default: %(default)s) '
                                  '(using Java might gain performance, but needs JDK)')
@@ -317,9 +353,9 @@ def execute():
         work_dir = join(args.out, 'grammar')
         hdd_tree = build_with_antlr4(args.src,
                                      input_format=args.input_format, start=args.start,
-                                     antlr=args.antlr, lang=args.parser,
+                                     antlr=args.antlr, lang=args.parser, embedded_antlr=args.embedded_antlr,
                                      build_hidden_tokens=args.build_hidden_tokens,
-                                     work_dir=work_dir)
+                                     work_dir=work_dir, cache_dir=args.grammar_cache)
         unparse_with_whitespace = not args.build_hidden_tokens
         if args.cleanup:
             rmtree(work_dir)
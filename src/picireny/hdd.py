@@ -10,6 +10,7 @@
 import itertools
 import logging
 
+from .hdd_tree import HDDRule
 from .info import height
 from .prune import prune
 
@@ -46,45 +47,55 @@ def hddmin(hdd_tree, *,
         config_filter is None).
     """
 
-    def collect_level_nodes(level):
-        def _collect_level_nodes(node, current_level):
-            if node.state != node.KEEP:
-                return
-            if current_level == level:
-                level_nodes.append(node)
-            elif hasattr(node, 'children'):
-                for child in node.children:
-                    _collect_level_nodes(child, current_level + 1)
-        level_nodes = []  # Using `list` (not `set`) for the sake of stability.
-        _collect_level_nodes(hdd_tree, 0)
-        return level_nodes
+    def collect_level_nodes(parent_nodes):
+        # The nodes of a level are the kept children of the rules of the level
+        # above (or the root, on the topmost level). Transformations only
+        # change the nodes of the level they work on, so every level can be
+        # collected from the one above, without walking the tree from its root.
+        # (Using `list` (not `set`) for the sake of stability.)
+        if parent_nodes is None:
+            return [hdd_tree] if hdd_tree.state == hdd_tree.KEEP else []
+        return [child
+                for node in parent_nodes if isinstance(node, HDDRule)
+                for child in node.children if child.state == child.KEEP]
 
     for iter_cnt in itertools.count():
         logger.info('Iteration #%d', iter_cnt)
 
         changed = False
+        parent_nodes = None
+        # The height of the tree is only logged, so it is not recomputed on
+        # every level (which would walk the whole tree again and again).
+        tree_height = height(hdd_tree) if logger.isEnabledFor(logging.INFO) else None
         for level in itertools.count():
-            level_nodes = collect_level_nodes(level)
+            level_nodes = collect_level_nodes(parent_nodes)
             if not level_nodes:
                 break
 
+            config_nodes = level_nodes
             if config_filter:
-                level_nodes = list(filter(config_filter, level_nodes))
-                if not level_nodes:
-                    continue
-
-            if logger.isEnabledFor(logging.INFO):
-                logger.info('Checking level %d / %d ...', level, height(hdd_tree))
-
-            for trans_cnt, transformation in enumerate(transformations):
-                hdd_tree, transformed = transformation(hdd_tree, level_nodes,
-                                                       reduce_class=reduce_class, reduce_config=reduce_config,
-                                                       tester_class=tester_class, tester_config=tester_config,
-                                                       id_prefix=id_prefix + (f'i{iter_cnt}', f'l{level}', f't{trans_cnt}'),
-                                                       cache=cache,
-                                                       unparse_with_whitespace=unparse_with_whitespace)
-
-                changed = changed or transformed
+                config_nodes = list(filter(config_filter, level_nodes))
+
+            if config_nodes:
+                logger.info('Checking level %d / %d ...', level, tree_height)
+
+                level_changed = False
+                for trans_cnt, transformation in enumerate(transformations):
+                    hdd_tree, transformed = transformation(hdd_tree, config_nodes,
+                                                           reduce_class=reduce_class, reduce_config=reduce_config,
+                                                           tester_class=tester_class, tester_config=tester_config,
+                                                           id_prefix=id_prefix + (f'i{iter_cnt}', f'l{level}', f't{trans_cnt}'),
+                                                           cache=cache,
+                                                           unparse_with_whitespace=unparse_with_whitespace)
+
+                    level_changed = level_changed or transformed
+
+                # Nodes of the level may have been removed or hoisted.
+                if level_changed:
+                    level_nodes = collect_level_nodes(parent_nodes)
+                    changed = True
+
+            parent_nodes = level_nodes
 
         if not hdd_star or not changed:
             break
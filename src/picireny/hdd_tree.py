@@ -16,6 +16,8 @@ class Position:
     Class defining a position in the input file. Used to recognise line breaks
     between tokens.
     """
+    __slots__ = ('line', 'column')
+
     def __init__(self, line=1, column=0):
         """
         Initialize position object.
@@ -53,6 +55,8 @@ class Position:
 
 
 class HDDTree:
+    __slots__ = ('name', 'replace', 'start', 'end', 'parent', 'state', 'id')
+
     # Node states for unparsing.
     REMOVED = 0
     KEEP = 1
@@ -84,12 +88,15 @@ class HDDTree:
         :param with_whitespace: Add whitespace (space, new line) to separate
             nonadjacent nodes.
         :param transform: A function applied to each node before unparsing, or
-            None.
+            None. It may return either a node to unparse instead of the original
+            one or the unparsed text of the node.
         :return: The unparsed test case.
         """
         def _unparse(node):
             if transform:
                 node = transform(node)
+                if isinstance(node, str):
+                    return node
 
             if node.state != node.KEEP:
                 return node.replace
@@ -130,6 +137,8 @@ class HDDTree:
 
 
 class HDDToken(HDDTree):
+    __slots__ = ('text',)
+
     def __init__(self, name, text, *, start=None, end=None, replace=None):
         super().__init__(name, start=start, end=end, replace=replace)
         self.text = text
@@ -153,9 +162,12 @@ class HDDToken(HDDTree):
 
 
 class HDDRule(HDDTree):
+    __slots__ = ('children', 'recursive_rule')
+
     def __init__(self, name, *, start=None, end=None, replace=None):
         super().__init__(name, start=start, end=end, replace=replace)
         self.children = []
+        self.recursive_rule = False
 
     def add_child(self, child):
         self.children.append(child)
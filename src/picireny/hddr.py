@@ -9,6 +9,7 @@
 import itertools
 import logging
 
+from .hdd_tree import HDDRule
 from .prune import prune
 
 logger = logging.getLogger(__name__)
@@ -77,7 +78,7 @@ def hddrmin(hdd_tree, *,
                 queue, node = queue[1:], queue[0]
             else:
                 queue, node = queue[:-1], queue[-1]
-            if not hasattr(node, 'children') or node.state != node.KEEP:
+            if not isinstance(node, HDDRule) or node.state != node.KEEP:
                 continue
 
             children = [child for child in node.children if child.state == child.KEEP]
@@ -11,6 +11,8 @@ import logging
 
 from picire import AbstractDD, Outcome
 
+from .hdd_tree import HDDRule
+
 logger = logging.getLogger(__name__)
 
 
@@ -65,12 +67,12 @@ class MappingMin(AbstractDD):
                 if desc.name == node.name:
                     hoistables.append(desc)
                     return
-                if hasattr(desc, 'children') and desc.state == desc.KEEP:
+                if isinstance(desc, HDDRule) and desc.state == desc.KEEP:
                     for child in desc.children:
                         _collect_hoistables(child)
 
             hoistables = []
-            if hasattr(node, 'children') and node.state == node.KEEP and node.name:
+            if isinstance(node, HDDRule) and node.state == node.KEEP and node.name:
                 for child in node.children:
                     _collect_hoistables(child)
             return hoistables
@@ -140,7 +142,7 @@ def hoist(hdd_tree, config_nodes, *,
 
     def _apply_mapping(node):
         node = mapping.get(node, node)
-        if hasattr(node, 'children'):
+        if isinstance(node, HDDRule):
             for i, child in enumerate(node.children):
                 node.children[i].replace_with(_apply_mapping(child))
         return node
@@ -7,10 +7,10 @@
 
 import logging
 
-from copy import copy
-
 from picire import AbstractDD, Outcome
 
+from .hdd_tree import HDDRule
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,6 +29,57 @@ class PruningTestBuilder:
         self.ids = ids
         self.with_whitespace = with_whitespace
 
+        # Only the rules on the paths from the root to the nodes that can change
+        # status have to be unparsed for every test case. All other subtrees
+        # (including those of the nodes that can change status) are unparsed
+        # only once and are substituted with their text.
+        self.frozen = {}
+        self.removed = {}
+        self._freeze()
+
+        # Content-based outcome caches build the test case of a configuration
+        # for looking it up, for testing it, and for storing its outcome, one
+        # right after the other. The last test case is remembered for them.
+        # (Configuration and test case are stored together, as a single
+        # attribute, so that they always belong together even if tests are
+        # built from multiple threads.)
+        self.last = (None, None)
+
+    def _freeze(self):
+        """
+        Prepare the substitutes of the subtrees that don't contain nodes that
+        can change status, and of the nodes that can.
+        """
+        # Find the nodes that can change status (without descending into them)
+        # and mark them and their ancestors as changing, with an explicit stack
+        # to avoid deep recursion.
+        parents = {}
+        changing = set()
+        rules = []
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node.id in self.ids:
+                self.frozen[node.id] = node.unparse(with_whitespace=self.with_whitespace)
+                self.removed[node.id] = node.replace
+                while node is not None and node.id not in changing:
+                    changing.add(node.id)
+                    node = parents.get(node.id)
+            elif isinstance(node, HDDRule) and node.state == node.KEEP:
+                rules.append(node)
+                for child in node.children:
+                    parents[child.id] = node
+                stack.extend(node.children)
+
+        # The children of changing rules that don't change are unparsed once.
+        for rule in rules:
+            if rule.id in changing:
+                for child in rule.children:
+                    if child.id not in changing:
+                        self.frozen[child.id] = child.unparse(with_whitespace=self.with_whitespace)
+        if self.tree.id not in changing:
+            self.frozen[self.tree.id] = self.tree.unparse(with_whitespace=self.with_whitespace)
+
     def __call__(self, config):
         """
         :param config: List of IDs of nodes that will be kept in the next test
@@ -36,15 +87,19 @@ class PruningTestBuilder:
         :return: The unparsed test case containing only the units defined in
             config.
         """
-        def removed(node):
+        def substitute(node):
             if node.id in self.ids and node.id not in config:
-                removed_node = copy(node)
-                removed_node.state = removed_node.REMOVED
-                return removed_node
-            return node
+                return self.removed[node.id]
+            return self.frozen.get(node.id, node)
+
+        config = frozenset(config)
+        last_config, last_test = self.last
+        if config == last_config:
+            return last_test
 
-        config = set(config)
-        return self.tree.unparse(with_whitespace=self.with_whitespace, transform=removed)
+        test = self.tree.unparse(with_whitespace=self.with_whitespace, transform=substitute)
+        self.last = (config, test)
+        return test
 
 
 class EmptyDD(AbstractDD):
@@ -137,7 +192,7 @@ def prune(hdd_tree, config_nodes, *,
     def _set_state(node):
         if node.id in config_ids_set:
             node.state = node.KEEP if node.id in c else node.REMOVED
-        elif hasattr(node, 'children') and node.state == node.KEEP:
+        elif isinstance(node, HDDRule) and node.state == node.KEEP:
             for child in node.children:
                 _set_state(child)
     _set_state(hdd_tree)
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+
+import configparser
+import sys
+
+
+c = configparser.ConfigParser(allow_no_value=True)
+with open(sys.argv[1], 'r') as f:
+    c.read_file(f)
+
+c.write(sys.stdout)
@@ -0,0 +1,2 @@
+@echo off
+python %~f0\..\sut-ini-load.py %1 | find "87" >NUL 2>&1
@@ -0,0 +1,2 @@
+#! /bin/bash
+python $(dirname $0)/sut-ini-load.py $1 | grep -q "87"
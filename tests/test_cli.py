@@ -6,6 +6,7 @@
 # according to those terms.
 
 import os
+import shutil
 import subprocess
 import sys
 
@@ -26,6 +27,8 @@ antlr = os.getenv('ANTLR')
     ('test-json-obj-arr-baz', 'inp-obj-arr.json', 'exp-obj-arr-baz.json', 'JSON.g4', 'json', None),
     ('test-json-obj-arr-87', 'inp-obj-arr.json', 'exp-obj-arr-87.json', 'JSON.g4', 'json', None),
     ('test-inijson-str-arr-87', 'inp-str-arr.ini', 'exp-str-arr-87.ini', None, None, 'inijson-crlf.json' if is_windows else 'inijson.json'),
+    ('test-inijson-str-arr-87', 'inp-str-arr-dup.ini', 'exp-str-arr-87.ini', None, None, 'inijson-crlf.json' if is_windows else 'inijson.json'),
+    ('test-ini-str-err-87', 'inp-str-err.ini', 'exp-str-err-87.ini', None, None, 'inijson-crlf.json' if is_windows else 'inijson.json'),
 ])
 @pytest.mark.parametrize('args', [
     ('--cache=config', ),
@@ -39,9 +42,40 @@ antlr = os.getenv('ANTLR')
     ('--parallel', ),
 ])
 def test_cli(test, inp, exp, grammar, rule, input_format, args, tmpdir):
-    out_dir = str(tmpdir)
+    run_cli(test, inp, exp, grammar, rule, input_format, args, str(tmpdir.join('out')), str(tmpdir.join('grammars')))
+
+
+@pytest.mark.parametrize('args', [
+    ('--parser=python', ),
+    ('--parser=java', ),
+])
+def test_grammar_cache(args, tmpdir):
+    # The first run prepares the grammars and fills the cache, the second run
+    # restores the grammars from the cache. If the files of the cache entries
+    # are removed, the third run prepares the grammars again.
+    cache_dir = str(tmpdir.join('grammars'))
+    for i, cached in enumerate((False, True, False)):
+        if i == 2:
+            for entry in os.scandir(cache_dir):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path)
+
+        stderr = run_cli('test-inijson-str-arr-87', 'inp-str-arr.ini', 'exp-str-arr-87.ini', None, None, 'inijson-crlf.json' if is_windows else 'inijson.json',
+                         args, str(tmpdir.join(f'out{i}')), cache_dir)
+        assert ('Target grammars are restored from cache' in stderr) == cached
+        assert os.listdir(cache_dir)
+
+
+def test_no_grammar_cache(tmpdir):
+    cache_dir = str(tmpdir.join('grammars'))
+    run_cli('test-inijson-str-arr-87', 'inp-str-arr.ini', 'exp-str-arr-87.ini', None, None, 'inijson-crlf.json' if is_windows else 'inijson.json',
+            ('--no-grammar-cache', ), str(tmpdir.join('out')), cache_dir)
+    assert not os.path.exists(cache_dir)
+
+
+def run_cli(test, inp, exp, grammar, rule, input_format, args, out_dir, cache_dir):
     cmd = (sys.executable, '-m', 'picireny') \
-        + (f'--test={test}{script_ext}', f'--input={inp}', f'--out={out_dir}') \
+        + (f'--test={test}{script_ext}', f'--input={inp}', f'--out={out_dir}', f'--grammar-cache={cache_dir}') \
         + ('--log-level=TRACE', )
     if grammar:
         cmd += (f'--grammar={grammar}', )
@@ -52,10 +86,14 @@ def test_cli(test, inp, exp, grammar, rule, input_format, args, tmpdir):
     if antlr:
         cmd += (f'--antlr={antlr}', )
     cmd += args
-    subprocess.run(cmd, cwd=resources_dir, check=True)
+    proc = subprocess.run(cmd, cwd=resources_dir, stderr=subprocess.PIPE, check=True)
+    stderr = proc.stderr.decode(errors='replace')
+    sys.stderr.write(stderr)
 
     with open(os.path.join(out_dir, inp), 'rb') as outf:
         outb = outf.read()
     with open(os.path.join(resources_dir, exp), 'rb') as expf:
         expb = expf.read()
     assert outb == expb
+
+    return stderr
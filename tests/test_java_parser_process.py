@@ -0,0 +1,58 @@
+# Copyright (c) 2016-2023 Renata Hodovan, Akos Kiss.
+#
+# Licensed under the BSD 3-Clause License
+# <LICENSE.rst or https://opensource.org/licenses/BSD-3-Clause>.
+# This file may not be copied, modified, or distributed except
+# according to those terms.
+
+import subprocess
+import sys
+
+import pytest
+
+from picireny.antlr4.java_parser_process import JavaParserProcess
+
+
+# Stand-in for the extended Java parser that speaks the same protocol: it
+# responds with the reversed input, or with an error message (prefixed by its
+# negated length) if the start rule is unknown.
+server = '''
+import sys
+
+def read_frame():
+    size = sys.stdin.buffer.read(4)
+    if not size:
+        sys.exit(0)
+    return sys.stdin.buffer.read(int.from_bytes(size, 'big'))
+
+while True:
+    start_rule, src = read_frame(), read_frame()
+    if start_rule == b'start':
+        response, size = src[::-1], len(src)
+    else:
+        response = b'unknown rule ' + start_rule
+        size = -len(response)
+    sys.stdout.buffer.write(size.to_bytes(4, 'big', signed=True) + response)
+    sys.stdout.buffer.flush()
+'''
+
+
+@pytest.fixture(name='process')
+def fixture_process(tmpdir):
+    proc = JavaParserProcess((sys.executable, '-c', server), cwd=str(tmpdir))
+    yield proc
+    proc.close()
+
+
+def test_requests(process):
+    for src in ('foo', '', 'bár' * 1000):
+        assert process.parse(src, 'start') == src.encode('utf-8')[::-1]
+
+
+def test_failed_request(process):
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        process.parse('foo', 'bar')
+    assert exc_info.value.stderr == 'unknown rule bar'
+
+    # The process keeps serving requests after a failure.
+    assert process.parse('foo', 'start') == b'oof'